@@ -1,13 +1,13 @@
-import os, re, uuid, datetime, imghdr
-from flask import Flask, request, jsonify, abort, Response, send_file
+import os, sys, hmac, stat, posixpath, time, errno, shutil, ctypes, datetime, threading
+from collections import OrderedDict
+from flask import Flask, request, jsonify, abort, Response
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.datastructures import Range
+from werkzeug.http import http_date, is_resource_modified
 from mimetypes import guess_type
-
-# Opcional: pip install flask-cors
-try:
-    from flask_cors import CORS
-except ImportError:
-    CORS = None
+from urllib.parse import quote
 
 app = Flask(__name__)
 
@@ -15,22 +15,111 @@ MEDIA_ROOT = os.getenv("MEDIA_ROOT", "/app/media")
 ALLOWED_EXT = set((os.getenv("ALLOWED_MEDIA_EXT", "mp4,webm,mov,m4v,avi,jpg,jpeg,png,webp").lower()).split(","))
 MAX_MB = int(os.getenv("MAX_UPLOAD_MB", "400"))
 UPLOAD_TOKEN = os.getenv("UPLOAD_TOKEN", "")  # Authorization: Bearer <token>
+# header esperado, em bytes (WSGI entrega headers decodificados como latin-1)
+_EXPECTED_AUTH = f"Bearer {UPLOAD_TOKEN}".encode() if UPLOAD_TOKEN else None
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "https://storage.grupoupper.com.br")  # ex: https://storage.seudominio.com.br
 ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "*").split(",")]
+_CORS_ORIGINS = frozenset(ALLOWED_ORIGINS)
+ROOT_ABS = os.path.realpath(MEDIA_ROOT) + os.sep  # resolvido uma vez no boot
+USE_X_ACCEL = os.getenv("USE_X_ACCEL", "") == "1"  # nginx entrega o arquivo (ver nginx.conf.example)
+X_ACCEL_PREFIX = os.getenv("X_ACCEL_PREFIX", "/internal/")
+CHUNK_SIZE = 64 * 1024  # leitura em blocos de 64 KiB quando não há sendfile
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # cópia do upload em blocos de 1 MiB
+# cache de stat: serve 304/404/X-Accel sem syscall; 200/206 ainda conferem o fd aberto com fstat
+STAT_CACHE_MAX = 4096   # entradas (positivas e negativas, cada uma)
+STAT_CACHE_TTL = 5.0    # segundos
 
 app.config["MAX_CONTENT_LENGTH"] = MAX_MB * 1024 * 1024
 
-if CORS:
-    CORS(app, resources={r"/*": {"origins": ALLOWED_ORIGINS}}, supports_credentials=True)
+class _CorsMiddleware:
+    """
+    Acrescenta headers CORS a toda resposta, direto no WSGI.
+    Reflete o Origin da request quando permitido (ou com "*"), com credenciais, como o flask-cors fazia.
+    """
+
+    _CREDENTIALS = ("Access-Control-Allow-Credentials", "true")
+    _VARY = ("Vary", "Origin")
+    _PREFLIGHT = [
+        ("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS"),
+        ("Access-Control-Max-Age", "86400"),
+    ]
+
+    def __init__(self, wsgi_app, origins):
+        self.wsgi_app = wsgi_app
+        self.any_origin = "*" in origins
+        self.origins = frozenset(origins)
+
+    def __call__(self, environ, start_response):
+        origin = environ.get("HTTP_ORIGIN")
+        if origin and (self.any_origin or origin in self.origins):
+            headers = [("Access-Control-Allow-Origin", origin), self._CREDENTIALS, self._VARY]
+            if environ.get("REQUEST_METHOD") == "OPTIONS" and "HTTP_ACCESS_CONTROL_REQUEST_METHOD" in environ:
+                # preflight (ex.: upload com Authorization vindo do front)
+                headers += self._PREFLIGHT
+                req_headers = environ.get("HTTP_ACCESS_CONTROL_REQUEST_HEADERS")
+                if req_headers:
+                    headers.append(("Access-Control-Allow-Headers", req_headers))
+        else:
+            # a resposta varia com o Origin; caches não podem reaproveitá-la entre origens
+            headers = [self._VARY]
+
+        def _start_response(status, response_headers, exc_info=None):
+            response_headers.extend(headers)
+            return start_response(status, response_headers, exc_info)
+
+        return self.wsgi_app(environ, _start_response)
+
+app.wsgi_app = _CorsMiddleware(app.wsgi_app, _CORS_ORIGINS)
+
+# MIME por extensão, resolvido no boot; guess_type fica só como fallback
+_EXT_MIME = {
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+    "mov": "video/quicktime",
+    "m4v": "video/x-m4v",
+    "avi": "video/x-msvideo",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+    "xls": "application/vnd.ms-excel",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+for _ext in ALLOWED_EXT - _EXT_MIME.keys():
+    _EXT_MIME[_ext] = guess_type(f"file.{_ext}")[0] or "application/octet-stream"
+
+def _mime_for(path: str) -> str:
+    mime = _EXT_MIME.get(path.rpartition(".")[2].lower())
+    return mime or guess_type(path)[0] or "application/octet-stream"
+
+# assinaturas (magic bytes) das imagens aceitas; webp é tratado à parte (RIFF....WEBP)
+_MAGIC = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+)
+_IMAGE_EXT = {"jpg", "jpeg", "png", "webp"}
+
+def _sniff_image(head: bytes):
+    if head[0:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for sig, kind in _MAGIC:
+        if head.startswith(sig):
+            return kind
+    return None
 
 def _allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXT
 
 def _auth_ok(req) -> bool:
-    if not UPLOAD_TOKEN:
+    if _EXPECTED_AUTH is None:
         return True  # sem token => sem auth (não recomendado em produção)
-    auth = req.headers.get("Authorization", "")
-    return auth.startswith("Bearer ") and auth.split(" ", 1)[1] == UPLOAD_TOKEN
+    # comparação em tempo constante
+    auth = req.headers.get("Authorization", "").encode("latin-1", "replace")
+    return hmac.compare_digest(auth, _EXPECTED_AUTH)
 
 @app.route("/health")
 def health():
@@ -49,87 +138,308 @@ def media_upload():
         return jsonify(ok=False, error="file extension not allowed"), 400
 
     ext = f.filename.rsplit(".", 1)[1].lower()
-    today = datetime.datetime.utcnow()
-    subdir = os.path.join(MEDIA_ROOT, "uploads", today.strftime("%Y"), today.strftime("%m"))
-    os.makedirs(subdir, exist_ok=True)
 
-    base = secure_filename(os.path.splitext(f.filename)[0])[:80] or "file"
-    filename = f"{base}-{uuid.uuid4().hex[:8]}.{ext}"
-    fullpath = os.path.join(subdir, filename)
-    f.save(fullpath)
-
-    # Validação mínima de imagem (protege upload trocado de extensão)
-    if ext in {"jpg", "jpeg", "png", "webp"}:
+    # Validação mínima de imagem (protege upload trocado de extensão), antes de tocar o disco
+    if ext in _IMAGE_EXT:
         try:
-            if ext == "webp":
-                # imghdr não detecta webp; deixa passar
-                pass
-            else:
-                detected = imghdr.what(fullpath)
-                if detected is None:
-                    return jsonify(ok=False, error="invalid image"), 400
+            head = f.stream.read(16)
+            f.stream.seek(0)
         except Exception:
             return jsonify(ok=False, error="invalid image"), 400
+        if _sniff_image(head) is None:
+            return jsonify(ok=False, error="invalid image"), 400
+
+    today = datetime.datetime.utcnow()
+    y, mo = f"{today.year:04d}", f"{today.month:02d}"
+    subdir = os.path.join(MEDIA_ROOT, "uploads", y, mo)
+    os.makedirs(subdir, exist_ok=True)
 
-    rel_url = f"/cdn/uploads/{today.strftime('%Y')}/{today.strftime('%m')}/{filename}"
+    base = secure_filename(os.path.splitext(f.filename)[0])[:80] or "file"
+    filename = f"{base}-{os.urandom(4).hex()}.{ext}"
+    fullpath = os.path.join(subdir, filename)
+    # grava direto no destino; O_EXCL nunca sobrescreve um arquivo existente
+    fd = os.open(fullpath, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0), 0o644)
+    try:
+        # BufferedWriter repete writes curtos (FileIO cru não; copyfileobj ignora o retorno)
+        with os.fdopen(fd, "wb") as dst:
+            shutil.copyfileobj(f.stream, dst, UPLOAD_CHUNK_SIZE)
+            size = dst.tell()
+    except Exception:
+        # não deixa arquivo parcial para trás (ex.: cliente desconectou)
+        os.remove(fullpath)
+        raise
+
+    rel_url = f"/cdn/uploads/{y}/{mo}/{filename}"
     abs_url = f"{PUBLIC_BASE_URL}{rel_url}"
-    mime = guess_type(fullpath)[0] or "application/octet-stream"
-    size = os.path.getsize(fullpath)
+    mime = _EXT_MIME[ext]
 
     return jsonify(ok=True, url=abs_url, rel_url=rel_url, mime=mime, size=size)
 
-def _file_iter(path, start=0, end=None, chunk=8192):
-    with open(path, "rb") as f:
-        f.seek(start)
-        remaining = None if end is None else end - start + 1
-        while True:
-            if remaining is not None and remaining <= 0:
-                break
-            read = chunk if remaining is None else min(chunk, remaining)
-            data = f.read(read)
-            if not data:
-                break
-            if remaining is not None:
-                remaining -= len(data)
-            yield data
+# statx(2) no Linux (opt-in via USE_STATX=1): AT_STATX_DONT_SYNC evita revalidar metadados
+# com o servidor em FS de rede (NFS/CIFS). Em disco local o overhead do ctypes deixa mais
+# lento que os.stat, por isso fica desligado por padrão.
+_AT_FDCWD = -100
+_AT_SYMLINK_NOFOLLOW = 0x100
+_AT_STATX_DONT_SYNC = 0x4000
+_STATX_MASK = 0x1 | 0x2 | 0x40 | 0x200  # TYPE | MODE | MTIME | SIZE
+
+class _StatxTimestamp(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_int64), ("tv_nsec", ctypes.c_uint32), ("_reserved", ctypes.c_int32)]
+
+class _Statx(ctypes.Structure):
+    _fields_ = [
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("_spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_blocks", ctypes.c_uint64),
+        ("stx_attributes_mask", ctypes.c_uint64),
+        ("stx_atime", _StatxTimestamp),
+        ("stx_btime", _StatxTimestamp),
+        ("stx_ctime", _StatxTimestamp),
+        ("stx_mtime", _StatxTimestamp),
+        ("_spare", ctypes.c_uint64 * 16),  # completa os 256 bytes de struct statx
+    ]
+
+def _load_statx():
+    if os.getenv("USE_STATX", "") != "1" or sys.platform != "linux":
+        return None
+    try:
+        fn = ctypes.CDLL("libc.so.6", use_errno=True).statx
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.POINTER(_Statx)]
+    fn.restype = ctypes.c_int
+    return fn
+
+_statx = _load_statx()  # detectado uma vez no boot
+
+def _fast_stat(path: str):
+    """lstat(path) -> (st_mode, st_size, st_mtime_ns), via statx quando disponível."""
+    global _statx
+    if _statx is not None:
+        buf = _Statx()
+        flags = _AT_SYMLINK_NOFOLLOW | _AT_STATX_DONT_SYNC
+        if _statx(_AT_FDCWD, os.fsencode(path), flags, _STATX_MASK, ctypes.byref(buf)) == 0:
+            if buf.stx_mask & _STATX_MASK == _STATX_MASK:
+                mt = buf.stx_mtime
+                return buf.stx_mode, buf.stx_size, mt.tv_sec * 1_000_000_000 + mt.tv_nsec
+        else:
+            err = ctypes.get_errno()
+            if err not in (errno.ENOSYS, errno.EPERM, errno.EINVAL):
+                # erro do arquivo (ENOENT, ENAMETOOLONG, EACCES...): _resolve trata como 404
+                raise OSError(err, os.strerror(err), path)
+            # syscall inutilizável (kernel sem statx, seccomp, flags não suportadas):
+            # desliga e usa os.stat daqui em diante
+            _statx = None
+    st = os.stat(path, follow_symlinks=False)
+    return st.st_mode, st.st_size, st.st_mtime_ns
+
+def _safe_join(rel: str) -> str:
+    """
+    Junta um path relativo a MEDIA_ROOT sem abspath/getcwd por request.
+    Levanta PermissionError se o path normalizado escapar de MEDIA_ROOT.
+    """
+    if "\0" in rel:
+        raise PermissionError("path traversal")
+    norm = posixpath.normpath(rel.replace("\\", "/"))
+    if norm == ".." or norm.startswith("../") or posixpath.isabs(norm):
+        raise PermissionError("path traversal")
+    return ROOT_ABS + norm
 
-@app.route("/cdn/<path:relpath>")
-def cdn(relpath):
-    # evita path traversal
-    safe_rel = os.path.normpath(relpath)
-    full = os.path.join(MEDIA_ROOT, safe_rel)
-    full = os.path.abspath(full)
-    root_abs = os.path.abspath(MEDIA_ROOT)
-    if not full.startswith(root_abs + os.sep):
-        abort(403)
+# cache de stat por full path (saída de _safe_join) -> (expira_em, full_abs, size, mtime_ns, mime)
+_stat_cache: "OrderedDict[str, tuple]" = OrderedDict()
+# cache negativo (404): full_abs -> expira_em
+_neg_cache: "OrderedDict[str, float]" = OrderedDict()
+_cache_lock = threading.Lock()
 
-    if not os.path.isfile(full):
-        abort(404)
+def _cache_put(cache: OrderedDict, key: str, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > STAT_CACHE_MAX:
+        cache.popitem(last=False)
 
-    mime = guess_type(full)[0] or "application/octet-stream"
-    file_size = os.path.getsize(full)
-
-    rng = request.headers.get("Range", "").strip()
-    m = re.match(r"bytes=(\d+)-(\d*)", rng) if rng else None
-    if m:
-        start = int(m.group(1))
-        end = int(m.group(2)) if m.group(2) else file_size - 1
-        if start >= file_size:
-            return Response(status=416)
-        headers = {
-            "Content-Type": mime,
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(end - start + 1),
+def _resolve(relpath: str):
+    """
+    Resolve um rel path (relativo a MEDIA_ROOT) para (full_abs, size, mtime_ns, mime, cached).
+    Retorna None se não for um arquivo regular; levanta PermissionError em path traversal.
+
+    Uma entrada positiva pode estar até STAT_CACHE_TTL atrasada (cached=True): basta para
+    revalidação (304) e X-Accel, mas quem serve o corpo deve conferir o fd aberto.
+    cached=False significa que o stat acabou de ser feito.
+    """
+    key = full = _safe_join(relpath)
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _stat_cache.get(key)
+        if hit is not None and hit[0] > now:
+            _stat_cache.move_to_end(key)
+            return hit[1:] + (True,)
+        exp = _neg_cache.get(key)
+        if exp is not None and exp > now:
+            return None
+
+    # um único lstat cobre isfile + getsize (symlinks não são servidos)
+    try:
+        st_mode, st_size, st_mtime_ns = _fast_stat(full)
+    except OSError:
+        st_mode = None
+    with _cache_lock:
+        if st_mode is None or not stat.S_ISREG(st_mode):
+            _stat_cache.pop(key, None)
+            _cache_put(_neg_cache, key, now + STAT_CACHE_TTL)
+            return None
+        mime = _mime_for(full)
+        entry = (full, st_size, st_mtime_ns, mime)
+        _neg_cache.pop(key, None)
+        _cache_put(_stat_cache, key, (now + STAT_CACHE_TTL,) + entry)
+    return entry + (False,)
+
+def _invalidate(full_abs: str):
+    with _cache_lock:
+        _stat_cache.pop(full_abs, None)
+        _neg_cache.pop(full_abs, None)
+
+def _x_accel_response(full: str, mime: str, etag: str, last_modified) -> Response:
+    # corpo vazio: nginx serve o arquivo da location interna (Range e sendfile nativos).
+    # ETag/Last-Modified são os do app, para a revalidação cair no 304 acima sem ir ao nginx.
+    return Response(
+        "",
+        mimetype=mime,
+        headers={
+            "X-Accel-Redirect": quote(X_ACCEL_PREFIX + full[len(ROOT_ABS):]),
+            "ETag": f'"{etag}"',
+            "Last-Modified": http_date(last_modified),
             "Cache-Control": "public, max-age=31536000",
-            "Access-Control-Allow-Origin": ",".join(ALLOWED_ORIGINS) if ALLOWED_ORIGINS != ["*"] else "*",
-        }
-        return Response(_file_iter(full, start, end), status=206, headers=headers)
+        },
+    )
+
+class _RangeFile:
+    """Janela [start, start+length) de um arquivo sem buffer já posicionado; expõe fileno() p/ sendfile."""
+
+    def __init__(self, f, length: int):
+        self._f = f
+        self._remaining = length
+
+    def fileno(self) -> int:
+        return self._f.fileno()
+
+    def read(self, n: int = -1) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        if n < 0 or n > self._remaining:
+            n = self._remaining
+        data = self._f.read(n)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+def _open_range(f, start: int, length: int) -> _RangeFile:
+    fd = f.fileno()
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, start, length, os.POSIX_FADV_SEQUENTIAL)
+    os.lseek(fd, start, os.SEEK_SET)
+    return _RangeFile(f, length)
+
+def _disposition_name(name: str) -> dict:
+    # mesmo formato do send_file: filename ASCII ou filename* em UTF-8 (RFC 5987)
+    try:
+        name.encode("ascii")
+    except UnicodeEncodeError:
+        return {"filename*": "UTF-8''" + quote(name, safe="!#$&+-.^_`|~")}
+    return {"filename": name}
+
+def _validators(size: int, mtime_ns: int):
+    """ETag e Last-Modified (em segundos, como no header HTTP) a partir do stat."""
+    etag = f"{size:x}-{mtime_ns:x}"
+    return etag, datetime.datetime.fromtimestamp(mtime_ns // 1_000_000_000, datetime.timezone.utc)
 
-    rv = send_file(full, mimetype=mime, conditional=True, as_attachment=False, max_age=31536000)
+@app.route("/cdn/<path:relpath>")
+def cdn(relpath):
+    try:
+        resolved = _resolve(relpath)
+    except PermissionError:
+        abort(403)
+    if resolved is None:
+        abort(404)
+    full, file_size, mtime_ns, mime, cached = resolved
+
+    # arquivos são imutáveis (nome com sufixo aleatório): revalidação vira 304 sem abrir o arquivo
+    etag, last_modified = _validators(file_size, mtime_ns)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(
+            status=304,
+            headers={
+                "ETag": f'"{etag}"',
+                "Cache-Control": "public, max-age=31536000",
+            },
+        )
+
+    if USE_X_ACCEL:
+        return _x_accel_response(full, mime, etag, last_modified)
+
+    # arquivo sem buffer (fd O_CLOEXEC): gunicorn/uWSGI entregam via sendfile(2) a partir do lseek
+    try:
+        f = open(full, "rb", buffering=0)
+    except OSError:
+        # entrada do cache sobreviveu ao arquivo (removido fora deste worker/app)
+        _invalidate(full)
+        abort(404)
+    try:
+        # hit no cache pode estar até STAT_CACHE_TTL atrasado: confere no fd já aberto (sem corrida).
+        # Em miss o stat é desta request; o fstat seria redundante. Em ambos: 2 syscalls até o corpo.
+        if cached:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                _invalidate(full)
+                abort(404)
+            if st.st_size != file_size or st.st_mtime_ns != mtime_ns:
+                _invalidate(full)
+                file_size, mtime_ns = st.st_size, st.st_mtime_ns
+                etag, last_modified = _validators(file_size, mtime_ns)
+
+        # Range/If-Range validados pelo werkzeug; o corpo continua sendo o fd
+        start, length, status = 0, file_size, 200
+        if request.range is not None and (
+            "HTTP_IF_RANGE" not in request.environ
+            or not is_resource_modified(
+                request.environ, etag=etag, last_modified=last_modified, ignore_if_range=False
+            )
+        ):
+            # multi-range: serve só o primeiro intervalo (como antes); 416 só se ele não couber
+            first = Range(request.range.units, request.range.ranges[:1])
+            bounds = first.range_for_length(file_size)
+            if bounds is None:
+                raise RequestedRangeNotSatisfiable(length=file_size)
+            start, length, status = bounds[0], bounds[1] - bounds[0], 206
+        body = _open_range(f, start, length)
+    except BaseException:
+        f.close()
+        raise
+
+    rv = Response(
+        wrap_file(request.environ, body, CHUNK_SIZE),
+        status=status,
+        mimetype=mime,
+        direct_passthrough=True,
+    )
+    rv.content_length = length
+    if status == 206:
+        rv.headers["Content-Range"] = f"bytes {start}-{start + length - 1}/{file_size}"
+    rv.headers.set("Content-Disposition", "inline", **_disposition_name(os.path.basename(full)))
+    rv.set_etag(etag)
+    rv.last_modified = last_modified
+    rv.expires = int(time.time() + 31536000)
     rv.headers["Accept-Ranges"] = "bytes"
     rv.headers["Cache-Control"] = "public, max-age=31536000"
-    rv.headers["Access-Control-Allow-Origin"] = ",".join(ALLOWED_ORIGINS) if ALLOWED_ORIGINS != ["*"] else "*"
     return rv
 
 def _to_rel_url(url_or_rel: str) -> str:
@@ -148,14 +458,8 @@ def _to_rel_url(url_or_rel: str) -> str:
     return s
 
 def _rel_to_full(rel_url: str) -> str:
-    rel = rel_url.lstrip("/")
-    full = os.path.join(MEDIA_ROOT, os.path.normpath(rel))
     # trava em MEDIA_ROOT
-    full_abs = os.path.abspath(full)
-    root_abs = os.path.abspath(MEDIA_ROOT)
-    if not full_abs.startswith(root_abs + os.sep):
-        raise PermissionError("path traversal")
-    return full_abs
+    return _safe_join(rel_url.lstrip("/"))
 
 @app.route("/admin/ping", methods=["GET"])
 def admin_ping():
@@ -196,32 +500,30 @@ def media_delete():
             return jsonify(ok=False, error="path must start with uploads/", got=s), 400
 
         # normaliza e trava em MEDIA_ROOT
-        full = os.path.join(MEDIA_ROOT, os.path.normpath(s))
-        full_abs = os.path.abspath(full)
-        root_abs = os.path.abspath(MEDIA_ROOT)
-        if not full_abs.startswith(root_abs + os.sep):
+        try:
+            full_abs = _safe_join(s)
+        except PermissionError:
             return jsonify(ok=False, error="forbidden path"), 403
 
-        if os.path.isfile(full_abs):
+        # remove direto (um syscall) em vez de isfile + remove
+        try:
             os.remove(full_abs)
-            # limpa diretórios vazios
-            try:
-                parent = os.path.dirname(full_abs)
-                for _ in range(3):
-                    if os.path.isdir(parent) and not os.listdir(parent):
-                        os.rmdir(parent)
-                        parent = os.path.dirname(parent)
-                    else:
-                        break
-            except Exception:
-                pass
-
-            return jsonify(ok=True, deleted="/cdn/" + s)
-        else:
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
             return jsonify(ok=False, error="file not found", rel_url="/cdn/" + s), 404
+        _invalidate(full_abs)
+        # limpa diretórios vazios; rmdir direto falha com ENOTEMPTY/EEXIST se ainda houver arquivos
+        parent = os.path.dirname(full_abs)
+        for _ in range(3):
+            try:
+                os.rmdir(parent)
+            except OSError as e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                    # o arquivo já foi removido; falha na limpeza não vira erro da request
+                    app.logger.warning("falha ao remover diretório %s: %s", parent, e)
+                break
+            parent = os.path.dirname(parent)
+
+        return jsonify(ok=True, deleted="/cdn/" + s)
 
     except Exception as e:
         return jsonify(ok=False, error=str(e)), 500
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
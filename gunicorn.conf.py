@@ -0,0 +1,24 @@
+# Configuração do gunicorn (lida automaticamente do diretório de trabalho)
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+reuse_port = True  # SO_REUSEPORT no socket de escuta
+
+# gthread: cada worker atende vários ranges em paralelo; workers escalam com os cores
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_tmp_dir = "/dev/shm"
+
+# carrega o app uma vez no master (config/ROOT_ABS calculados no boot e compartilhados via COW)
+preload_app = True
+
+# sendfile(2) fica ligado por padrão quando a resposta é um wsgi.file_wrapper.
+# Não defina "sendfile" aqui: no gunicorn qualquer valor (inclusive True) desliga;
+# use SENDFILE=0 no ambiente para desativar.
+
+# uploads de até MAX_UPLOAD_MB podem demorar mais que o default de 30s
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,4 @@
+# Entrypoint WSGI para produção: gunicorn -c gunicorn.conf.py wsgi:application
+from app import app
+
+application = app